@@ -7,7 +7,7 @@ Usage:
     python get_data_by_id.py -v -gp mls_tor 2021-12-23T17:15:09-05:00
 """
 
-import requests, logging, configparser, argparse, os, sys
+import requests, logging, configparser, argparse, os, sys, io, gzip, random, re
 import matplotlib
 matplotlib.use('Agg')
 
@@ -15,28 +15,87 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
-from time import time
-from datetime import datetime, timezone
-from dateutil import tz
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
-from azure.datalake.store import core, lib, multithread
+from time import time, sleep
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# orjson parses the API payloads much faster, fall back to json if missing
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# pyarrow parses the CSV fallback in get_max_id_adl faster, pandas is used if missing
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.compute as pc
+except ImportError:
+    pacsv = None
+
+from azure.datalake.store import core, lib
 # from azure.storage.blob import BlockBlobService
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 MAX_RECORDS_PER_FILE = 1000000
-
-
+TORONTO_TZ = ZoneInfo('America/Toronto')
+# File names written by push_to_adl: <run time>_<min id>_<max id>.csv[.gz]
+ADL_FILE_NAME = re.compile(r'^\d{4}-\d{2}-\d{2}_\d{2}_\d{2}_\d{2}_(\d+)_(\d+)\.csv(\.gz)?$')
+
+# Columns written to ADL for each collection
+ACTIONS_COLS = ['id', 'in_venue', 'invisible_date_time', 'request_date_time', 'resource_major', 'resource_minor', 'session_id', 'sort_order', 'type_major', 'type_minor','yinzid']
+SESSIONS_COLS = ['actions', 'app_id', 'app_version','carrier','device_adid','device_generated_id','device_id','end_date_time','hardware_device_id','id','mcc','mdn','mnc','os_version','start_date_time']
+GEOIP_COLS = ['city_geoname_id','city_name','continent_code','continent_geoname_id','continent_name','country_code','country_geoname_id','country_name','id','postal_code','session_device_generated_id','subdivision1_code','subdivision1_geoname_id','subdivision1_name','subdivision2_code','subdivision2_geoname_id','subdivision2_name','subdivision3_code','subdivision3_geoname_id','subdivision3_name','subdivision4_code','subdivision4_geoname_id','subdivision4_name','time_zone']
+HARDWARE_COLS = ['id','manufacturer','model','platform','screen_width','screen_height']
+
+# Low cardinality columns are stored as categories to save memory
+ACTIONS_DTYPES = {'id': 'int64', 'type_major': 'category', 'type_minor': 'category',
+                  'resource_major': 'category', 'resource_minor': 'category'}
+SESSIONS_DTYPES = {'app_id': 'category', 'app_version': 'category', 'carrier': 'category',
+                   'os_version': 'category'}
+GEOIP_DTYPES = {'continent_code': 'category', 'continent_name': 'category', 'country_code': 'category',
+                'country_name': 'category', 'subdivision1_code': 'category', 'subdivision1_name': 'category',
+                'time_zone': 'category'}
+HARDWARE_DTYPES = {'manufacturer': 'category', 'model': 'category', 'platform': 'category'}
+
+
+@lru_cache(maxsize=128)
 def get_right_format(time):
     utc = datetime.strptime(time,'%Y-%m-%dT%H:%M:%S%z')
-    to_zone =  tz.gettz('America/Toronto')
-    time_est = utc.astimezone(to_zone)
+    time_est = utc.astimezone(TORONTO_TZ)
     str_time_est = time_est.strftime('%Y-%m-%d_%H_%M_%S')
     return str_time_est
 
 
-def get_data(maxId, auth, max_value=100000000, verbose=False):
+def cast_columns(df, dtypes):
+    """Casts the columns of df listed in dtypes, skipping any the payload lacks
+    """
+    return df.astype({col: dtype for col, dtype in dtypes.items() if col in df})
+
+
+def get_session():
+    """Creates a pooled Session that retries server errors with backoff
+    """
+    retry_strategy = Retry(
+        total=5,
+        backoff_factor=2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry_strategy)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+def get_data(maxId, auth, session, max_value=100000000, verbose=False):
     """Gets data from the Yinzcam Realtime API
     """
     newMaxId = maxId + 1
@@ -54,71 +113,64 @@ def get_data(maxId, auth, max_value=100000000, verbose=False):
     while maxRecords >= limit and value_count < max_value_count:
         url = 'https://mlse-analytics-api.yinzcam.com/analytics/raw/actions?startId=' \
             + str(newMaxId) + '&maxRecords='+str(maxRecords)+'&sortBy=id'
-        retry = 5
-        response = None
         status_code = None
         content = None
-        timeout = False
 
-        # API retry loop handles timeouts and no content issues
-        while retry > 0:
-            # Try the API call and handle timeout (60 sec) if applicable
+        content_attempts = 3
+
+        # Retries on timeouts and server errors are handled by the session adapter,
+        # only responses with unreadable content are retried here
+        for attempt in range(content_attempts):
+            try:
+                response = session.get(url, auth=auth, timeout=(10, 240))
+            except requests.exceptions.RequestException as e:
+                logger.info("Error with call #%s: %s", number_of_calls, e)
+                break
+            status_code = response.status_code
+            logger.debug("Call #%s: The status call of this call is %s", number_of_calls, status_code)
+
             try:
-                response = requests.get(url, auth=auth, timeout=240)
-                status_code = response.status_code
-                logging.info("Call #{number_of_calls}: The status call of this call is {status_code}".format(
-                    number_of_calls=number_of_calls, status_code=status_code))
-            except Exception as e:
-                timeout = True
-                logging.info("Timeout reached, error details: {e}".format(e=e))
-
-            if timeout:
-                # Keep retrying timed out call max 5 times
-                retry -= 1
-                logging.info("Call #{number_of_calls} timed-out, number of retries left {retry}...".format(
-                    number_of_calls=number_of_calls, retry=retry))
-                timeout = False
+                content = json_loads(response.content)
+            except ValueError as e:
+                logger.info("Error with content: %s", e)
+                if attempt < content_attempts - 1:
+                    logger.info("Retrying call #%s...", number_of_calls)
+                    sleep(random.uniform(1, 3))
             else:
-                # Check that the call returned content, and if not, retry
-                try:
-                    content = response.json()
-                except Exception as e:
-                    retry -= 1
-                    logging.info("Error with content: {e}".format(e=e))
-                    logging.info("Retrying call #{number_of_calls}...".format(
-                        number_of_calls=number_of_calls))
-                else:
-                    retry = 0
+                break
 
         # If content received from call, process
         if content:
-            logging.info("Content received, processing.")
-            actions = pd.DataFrame(content['actions'])
+            logger.debug("Content received, processing.")
+            actions = content['actions']
             maxRecords = len(actions)
             if maxRecords > 0:
                 value_count += maxRecords
-                newMaxId = actions.id.astype(int).max() + 1
-                actions_l.append(actions)
-                sessions_l.append(pd.DataFrame(content['sessions']))
-                geoip_l.append(pd.DataFrame(content['geoip']))
-                hardware_l.append(pd.DataFrame(content['hardware']))
+                newMaxId = max(int(a['id']) for a in actions) + 1
+                # Keep the raw records, DataFrames are built once at the end
+                actions_l.extend(actions)
+                sessions_l.extend(content['sessions'])
+                geoip_l.extend(content['geoip'])
+                hardware_l.extend(content['hardware'])
                 number_of_calls += 1
-                logging.info("New Max ID: {0}".format(newMaxId))
-                logging.info('Number of calls {0}, and status code {1}, maxRecords = {2}, and number of records = {3}'.format(
-                    number_of_calls, status_code, maxRecords, value_count))
+                logger.debug("New Max ID: %s", newMaxId)
+                logger.debug('Number of calls %s, and status code %s, maxRecords = %s, and number of records = %s',
+                    number_of_calls, status_code, maxRecords, value_count)
         # If max retries made and no content recieved, exit the API call loop
         else:
-            logging.info("Max retries met, no data from this call. Exiting.")
+            logger.info("Max retries met, no data from this call. Exiting.")
             break
 
-    logging.info("Finished Getting Data...")
+    logger.info("Finished Getting Data...")
 
     if value_count > 0:
+        # Cast the ids and low cardinality columns once while the frames are built,
+        # so they are held as int64 and categories through dedupe and the push
         return (value_count,
-                {'actions': pd.concat(actions_l, axis=0),
-                 'sessions': pd.concat(sessions_l, axis=0),
-                 'geoip': pd.concat(geoip_l, axis=0),
-                 'hardware': pd.concat(hardware_l, axis=0)}
+                {'actions': cast_columns(pd.DataFrame(actions_l), ACTIONS_DTYPES),
+                 'sessions': cast_columns(pd.DataFrame(sessions_l), SESSIONS_DTYPES),
+                 'geoip': cast_columns(pd.DataFrame(geoip_l), GEOIP_DTYPES),
+                 'hardware': cast_columns(pd.DataFrame(hardware_l), HARDWARE_DTYPES)}
                 )
     else:
         return 0, None
@@ -133,24 +185,164 @@ def get_max_id_adl(team, adlsFileSystemClient, verbose = False):
         listFiles = []
     if len(listFiles) > 0:
         last_file = listFiles[-1]
-        with adlsFileSystemClient.open(last_file, 'rb') as f:
-            df = pd.read_csv(f)
-        maxId = df.id.astype(int).max()
+        # Files are named <run time>_<min id>_<max id>.csv, so the max ID can
+        # be read from the name without downloading the file
+        match = ADL_FILE_NAME.match(last_file.rsplit('/', 1)[-1])
+        if match and int(match.group(1)) <= int(match.group(2)):
+            maxId = int(match.group(2))
+        else:
+            with adlsFileSystemClient.open(last_file, 'rb') as f:
+                # Only the id column is needed to find the max ID
+                if pacsv is not None:
+                    source = gzip.GzipFile(fileobj=f) if last_file.endswith('.gz') else f
+                    tbl = pacsv.read_csv(source, convert_options=pacsv.ConvertOptions(
+                        include_columns=['id'], column_types={'id': pa.int64()}))
+                    maxId = pc.max(tbl['id']).as_py()
+                else:
+                    df = pd.read_csv(f, usecols=['id'], dtype={'id': 'int64'},
+                                     compression='gzip' if last_file.endswith('.gz') else None)
+                    maxId = df.id.max()
         if verbose:
-            logging.info("The max ID from actions in ADL is {0}!".format(maxId))
+            logger.info("The max ID from actions in ADL is %s!", maxId)
         return maxId
     else:
         if verbose:
-            logging.info("The min ID is 1")
+            logger.info("The min ID is 1")
         return 0
 
-def push_to_adl(team, adlsFileSystemClient, collection, df, currentRunTime, minAct, maxAct, verbose = False):
+def push_to_adl(team, adlsFileSystemClient, collection, df, currentRunTime, minAct, maxAct, verbose = False,
+                compress = False):
     data_lake_directory = '/yinz_cam/' + team +  '/realtime_api/' + collection + '/'
-    fileName = get_right_format(currentRunTime) + '_' + str(minAct) + '_' + str(maxAct) + '.csv'
+    extension = '.csv.gz' if compress else '.csv'
+    fileName = get_right_format(currentRunTime) + '_' + str(minAct) + '_' + str(maxAct) + extension
     with adlsFileSystemClient.open(data_lake_directory + fileName, 'wb') as f:
         if verbose:
-            logging.info("Writing {0} to ADL".format(data_lake_directory + fileName))
-        f.write(str.encode(df.to_csv(index = False)))
+            logger.info("Writing %s to ADL", data_lake_directory + fileName)
+        # Stream the CSV into the ADL file instead of building it in memory
+        out = gzip.GzipFile(fileobj=f, mode='wb') if compress else f
+        writer = io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=True)
+        df.to_csv(writer, index = False)
+        writer.flush()
+        writer.detach()
+        if compress:
+            out.close()
+
+
+def fetch_windows(team, adlsFileSystemClient, auth, session, currentRunTime, verbose=False):
+    """Yields (num_of_records, dfs, minAct, maxAct) for each window of new records
+    """
+    t1 = time()
+    maxId = get_max_id_adl(
+        team, adlsFileSystemClient, verbose=verbose)
+    t2 = time()
+    if verbose:
+        logger.info("It took %s min to read the maxID from ADL", (t2 - t1)/60)
+
+    num_of_records = MAX_RECORDS_PER_FILE
+    while num_of_records == MAX_RECORDS_PER_FILE:
+        t2 = time()
+        num_of_records, dfs = get_data(
+            maxId, auth, session, max_value=MAX_RECORDS_PER_FILE, verbose=True)
+        t3 = time()
+
+        if num_of_records == 0:
+            logger.info("No new records to process.")
+            break
+
+        if verbose:
+            logger.info("It took %s min to get the data from YinzCam", (t3 - t2)/60)
+            logger.info("Number of actions = %s", len(dfs['actions']))
+            logger.info("Number of sessions = %s", len(dfs['sessions']))
+            logger.info("Number of geoips = %s", len(dfs['geoip']))
+            logger.info("Number of hardwares = %s", len(dfs['hardware']))
+
+        minAct = dfs['actions'].id.min()
+        maxAct = dfs['actions'].id.max()
+
+        if verbose:
+            logger.info("Min = %s and Max = %s from this Yinzcam call at %s",
+                minAct,
+                maxAct,
+                get_right_format(currentRunTime))
+
+        yield num_of_records, dfs, minAct, maxAct
+
+        # The next window starts after the records just fetched, so ADL does
+        # not need to be read again while this window is still being pushed
+        maxId = maxAct
+
+
+def process_window(team, adlsFileSystemClient, dfs, currentRunTime, minAct, maxAct,
+                   verbose=False, generate_plot=False, compress=False):
+    """Cleans one window of records and pushes it to ADL
+    """
+    if verbose:
+        t1 = time()
+
+    # Records are identified by id, so only that column needs to be hashed
+    dfs['sessions'] = dfs['sessions'].drop_duplicates(subset=['id'], keep='last', ignore_index=True)
+    dfs['actions'] = dfs['actions'].drop_duplicates(subset=['id'], keep='last', ignore_index=True)
+    # Geoip payloads sometimes lack expected columns, dedupe on every column then
+    if 'id' in dfs['geoip']:
+        dfs['geoip'] = dfs['geoip'].drop_duplicates(subset=['id'], keep='last', ignore_index=True)
+    else:
+        dfs['geoip'] = dfs['geoip'].drop_duplicates(keep='last', ignore_index=True)
+    dfs['hardware'] = dfs['hardware'].drop_duplicates(subset=['id'], keep='last', ignore_index=True)
+    # Organize columns 
+    dfs['actions'] = dfs['actions'][ACTIONS_COLS]
+    dfs['sessions'] = dfs['sessions'][SESSIONS_COLS]
+    try:
+        dfs['geoip'] = dfs['geoip'][GEOIP_COLS]
+    except KeyError:
+        logger.warning("Unexpected geoip columns: %s", dfs['geoip'].columns.values)
+    dfs['hardware'] = dfs['hardware'][HARDWARE_COLS]
+
+    if verbose:
+        t2 = time()
+        logger.info("It took %s min to get rid of duplicates", (t2 - t1)/60)
+
+        logger.info("Number of actions = %s", len(dfs['actions']))
+        logger.info("Number of sessions = %s", len(dfs['sessions']))
+        logger.info("Number of geoips = %s", len(dfs['geoip']))
+        logger.info("Number of hardwares = %s", len(dfs['hardware']))
+
+    t1 = time()
+    # The four collections are independent files, so push them concurrently
+    def push(collection):
+        logger.info('Pushing %s to ADL', collection)
+        push_to_adl(team, adlsFileSystemClient, collection,
+                    dfs[collection], currentRunTime, minAct, maxAct, verbose=verbose,
+                    compress=compress)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(push, ['actions', 'sessions', 'geoip', 'hardware']))
+    t2 = time()
+    if verbose:
+        logger.info("It took %s min to write Pandas DF to ADL", (t2 - t1)/60)
+
+    if generate_plot:
+        t1 = time()
+        # Parse the dates once and bucket them by month in a single vectorized pass
+        request_date_time = pd.to_datetime(dfs['actions'].request_date_time)
+        month = request_date_time.dt.to_period('M').astype(str).rename('month')
+        grouped = month.groupby(month).size()
+        ax = (np.log10(grouped)).plot(kind='bar', figsize=(8, 8))
+        ax.set_xlabel('Month')
+        ax.set_ylabel('log10 Count')
+        ax.grid()
+        fileNamePlot = "update_" + \
+            get_right_format(currentRunTime) + '.pdf'
+        data_lake_directory = '/yinz_cam/' + team + '/realtime_api/figure_checks/'
+        # The plot is small, so write it through the shared ADL client rather
+        # than spinning up a multithreaded uploader for a temporary file
+        plot = io.BytesIO()
+        plt.savefig(plot, format='pdf')
+        with adlsFileSystemClient.open(data_lake_directory + fileNamePlot, 'wb') as f:
+            f.write(plot.getvalue())
+        t2 = time()
+        if verbose:
+            logger.info("It took %s min to generate the checkup plot", (t2 - t1)/60)
+            logger.info(grouped.sort_values(ascending=False))
 
 
 def main():
@@ -160,6 +352,7 @@ def main():
     parser.add_argument('start_time', help="the start date time of the task", type=str)
     parser.add_argument('-v','--verbose', action='store_true',help='prints output to the stdout, such as timing and what it is doing')
     parser.add_argument('-gp','--generate_plot',action='store_true',help='creates a histogram of the pull by month')
+    parser.add_argument('-c','--compress',action='store_true',help='writes gzip compressed CSV files (.csv.gz) to ADL')
 
     args = parser.parse_args()
     team = args.team
@@ -189,122 +382,25 @@ def main():
                         resource = 'https://datalake.azure.net/')
 
     adlsFileSystemClient = core.AzureDLFileSystem(adlCreds, store_name = store_name)
-
-    # maxId =  1340320433 # 267450897
-    num_of_records = 1000000
-    while num_of_records == MAX_RECORDS_PER_FILE:
-        t1 = time()
-        maxId = get_max_id_adl(
-            team, adlsFileSystemClient, verbose=args.verbose)
-        t2 = time()
-        if args.verbose:
-            logging.info(
-                "It took {0} min to read the maxID from ADL".format(float(t2 - t1)/60))
-        num_of_records, dfs = get_data(
-            maxId, auth, max_value=MAX_RECORDS_PER_FILE, verbose=True)
-        t3 = time()
-
-        if num_of_records > 0:
-            if args.verbose:
-                logging.info(
-                    "It took {0} min to get the data from YinzCam".format(float(t3 - t2)/60))
-                logging.info("Number of actions = {0}".format(
-                    len(dfs['actions'])))
-                logging.info("Number of sessions = {0}".format(
-                    len(dfs['sessions'])))
-                logging.info(
-                    "Number of geoips = {0}".format(len(dfs['geoip'])))
-                logging.info("Number of hardwares = {0}".format(
-                    len(dfs['hardware'])))
-
-            dfs['actions'].id = dfs['actions'].id.astype(int)
-
-            minAct = dfs['actions'].id.min()
-            maxAct = dfs['actions'].id.max()
-
-            if args.verbose:
-                logging.info("Min = {0} and Max = {1} from this Yinzcam call at {2}".format(
-                    minAct,
-                    maxAct,
-                    get_right_format(currentRunTime)))
-
-                t1 = time()
-
-            dfs['sessions'] = dfs['sessions'].drop_duplicates(keep='last')
-            dfs['actions'] = dfs['actions'].drop_duplicates(keep='last')
-            dfs['geoip'] = dfs['geoip'].drop_duplicates(keep='last')
-            dfs['hardware'] = dfs['hardware'].drop_duplicates(keep='last')
-            # Organize columns 
-            actions_cols = ['id', 'in_venue', 'invisible_date_time', 'request_date_time', 'resource_major', 'resource_minor', 'session_id', 'sort_order', 'type_major', 'type_minor','yinzid']
-            sessions_cols = ['actions', 'app_id', 'app_version','carrier','device_adid','device_generated_id','device_id','end_date_time','hardware_device_id','id','mcc','mdn','mnc','os_version','start_date_time']
-            geoip_cols = ['city_geoname_id','city_name','continent_code','continent_geoname_id','continent_name','country_code','country_geoname_id','country_name','id','postal_code','session_device_generated_id','subdivision1_code','subdivision1_geoname_id','subdivision1_name','subdivision2_code','subdivision2_geoname_id','subdivision2_name','subdivision3_code','subdivision3_geoname_id','subdivision3_name','subdivision4_code','subdivision4_geoname_id','subdivision4_name','time_zone']
-            hardware_cols = ['id','manufacturer','model','platform','screen_width','screen_height']
-            dfs['actions'] = dfs['actions'][actions_cols]
-            dfs['sessions'] = dfs['sessions'][sessions_cols]
-            try:
-                dfs['geoip'] = dfs['geoip'][geoip_cols]
-            except:
-                print(dfs['geoip'].columns.values)
-            dfs['hardware'] = dfs['hardware'][hardware_cols]
-
-            if args.verbose:
-                t2 = time()
-                logging.info(
-                    "It took {0} min to get rid of duplicates".format(float(t2 - t1)/60))
-
-                logging.info("Number of actions = {0}".format(
-                    len(dfs['actions'])))
-                logging.info("Number of sessions = {0}".format(
-                    len(dfs['sessions'])))
-                logging.info(
-                    "Number of geoips = {0}".format(len(dfs['geoip'])))
-                logging.info("Number of hardwares = {0}".format(
-                    len(dfs['hardware'])))
-
-            t1 = time()
-            for collection in ['actions', 'sessions', 'geoip', 'hardware']:
-                print('Pushing {0} to ADL'.format(collection))
-                push_to_adl(team, adlsFileSystemClient, collection,
-                            dfs[collection], currentRunTime, minAct, maxAct, verbose=args.verbose)
-            t2 = time()
-            if args.verbose:
-                logging.info(
-                    "It took {0} min to write Pandas DF to ADL".format(float(t2 - t1)/60))
-
-            if args.generate_plot:
-                t1 = time()
-                dfs['actions'].request_date_time = pd.to_datetime(
-                    dfs['actions'].request_date_time)
-                dfs['actions']['date'] = dfs['actions'].request_date_time.dt.date
-                dfs['actions']['month'] = dfs['actions'].request_date_time.apply(
-                    lambda x: x.strftime('%Y-%m'))
-                grouped = dfs['actions'].groupby('month').size()
-                ax = (np.log10(grouped)).plot(kind='bar', figsize=(8, 8))
-                ax.set_xlabel('Month')
-                ax.set_ylabel('log10 Count')
-                ax.grid()
-                fileNamePlot = "update_" + \
-                    get_right_format(currentRunTime) + '.pdf'
-                data_lake_directory = '/yinz_cam/' + team + '/realtime_api/figure_checks/'
-                plt.savefig('/tmp/' + fileNamePlot)
-                multithread.ADLUploader(adlsFileSystemClient, lpath='/tmp/' + fileNamePlot,
-                                        rpath=data_lake_directory+fileNamePlot,
-                                        nthreads=64, overwrite=True,
-                                        buffersize=4194304, blocksize=4194304)
-                t2 = time()
-                os.remove('/tmp/' + fileNamePlot)
-                if args.verbose:
-                    logging.info(
-                        "It took {0} min to generate the checkup plot".format(float(t2 - t1)/60))
-                    logging.info(grouped.sort_values(ascending=False))
-
-        else:
-            logging.info("No new records to process.")
-            break
+    session = get_session()
+
+    # Fetch the next window while the previous one is being pushed to ADL.
+    # Only one window is pushed at a time so at most two are held in memory.
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for num_of_records, dfs, minAct, maxAct in fetch_windows(
+                team, adlsFileSystemClient, auth, session, currentRunTime, verbose=args.verbose):
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(
+                process_window, team, adlsFileSystemClient, dfs, currentRunTime, minAct, maxAct,
+                verbose=args.verbose, generate_plot=args.generate_plot, compress=args.compress)
+        if pending is not None:
+            pending.result()
 
 
 if __name__ == "__main__":
     elapsed = time()
     main()
     elapsed = time() - elapsed
-    logging.info("It took {0:.2f} min to call YinzCam".format(float(elapsed)/60))
\ No newline at end of file
+    logger.info("It took %.2f min to call YinzCam", elapsed/60)
\ No newline at end of file
@@ -36,6 +36,8 @@ import argparse                     # Parses predefined arguments out of sys.arg
 import logging                      # Implement a flexible event logging system
 from time import time               # Provides various time related functions
 from datetime import datetime       # Supplies classes for manipulating dates and time
+from concurrent.futures import ThreadPoolExecutor
+                                    # Runs the paginated API calls concurrently
 
 import requests                     # An elegant and simple HTTP library for Python
 from requests.adapters import HTTPAdapter
@@ -46,7 +48,14 @@ from azure.datalake.store import core, lib, multithread
 
 import os                           # Portable way of using operating system functions
 import sys                          # Provides access to variables used by the interpreter
-import json                         # JSON encoder and decoder
+try:
+    from orjson import loads as json_loads
+                                    # Fast JSON parser for the API payloads
+except ImportError:
+    from json import loads as json_loads
+                                    # JSON decoder, used when orjson is missing
+import io                           # Core tools for working with streams
+import gzip                         # Support for gzip files
 
 import pandas as pd                 # Data analysis and manipulation tool for Python
 import numpy as np                  # Core library for scientific computing with Python
@@ -60,22 +69,39 @@ __date__    = "March 31, 2020"
 __status__  = "Prototype"
 
 
+# Set up Requests retry function to retry call on server error. The session is
+# shared by every API call so the connection to YinzCam is kept alive.
+retry_strategy = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+)
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry_strategy)
+http = requests.Session()
+http.mount("https://", adapter)
+http.mount("http://", adapter)
+
+# Number of pages requested from the YinzCam API at the same time
+PAGE_WORKERS = 8
+
+
 # =============================================================================
-#   IngestUserProfiles(team, page=0, limit=10000)                             =
+#   IngestUserProfiles(team, page=0, limit=10000, compress=False)             =
 #                                                                             =
 #   Accepts `team` arg value, which is one of NHL, MLS, or NBA.               =
 #   Creates User Table Dataframe by ingesting the User Profiles from YinzCam. =
-#   Response payload limited to 10,000 users per call. Passes raw JSON user   =
-#   profiles to `FormatUsers`, then converts to DataFrame. Concats DF from    =
-#   each call. Passes complete DF to ExportCSVtoADL.                          =
+#   Response payload limited to 10,000 users per call, pages are fetched      =
+#   concurrently by `GetUsersPage`. Passes raw JSON user profiles to          =
+#   `FormatUsers`, which returns a DataFrame. Concats the DFs from all calls  =
+#   once. Passes complete DF to ExportCSVtoADL.                               =
 # =============================================================================
 
-def IngestUserProfiles(team, page=0, limit=10000):
+def IngestUserProfiles(team, page=0, limit=10000, compress=False):
     start_ingest = time()
-    logging.info("Starting IngestUserProfiles for {team}.".format(team=team))
+    logging.info("Starting IngestUserProfiles for %s.", team)
 
-    # Empty DF to hold users
-    UserDF = pd.DataFrame()
+    # List to hold the user DF from each call
+    UserDF_list = []
 
     # Assign mobile app address based on team arg value
     if team == "MLS":
@@ -88,131 +114,147 @@ def IngestUserProfiles(team, page=0, limit=10000):
     # Get authenication info for YinzCam API
     user, pssd = get_yinz_conf(team)
 
-    # Set up Requests retry function to retry call on server error
-    retry_strategy = Retry(
-        total=3,
-        status_forcelist=[429, 500, 502, 503, 504],
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    http = requests.Session()
-    http.mount("https://", adapter)
-    http.mount("http://", adapter)
-
-    # Call the YinzCam API, looping through pages of 10,000 until complete
-    while True:
-        t1 = time()
-        logging.info("Creating API call for page {page}.".format(page=page))
-
-        # Format the API url
-        url = ('https://ydp-api.yinzcam.com/profiles/JANRAIN?page={page}&limit={limit}'\
-                    .format(page=page, limit=10000))
-
-        # Try the API call
-        try:
-            logging.info("Sending GET request to YinzCam API.")
-            response = http.get(url=url, auth=(user,pssd), timeout=240)
-            rsp_code = response.status_code
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            logging.error("GET request to API failed. Response code: {response_code}. \
-                Error: {error}.".format(response_code=rsp_code, error=str(e)))
-            raise
-        else:
-            logging.info("Response code: {response_code}.".format(response_code=rsp_code))
-            users_raw = response.json()['Users']
-            logging.info("Page {page_number} has {total_users} records."\
-                    .format(page_number=page,total_users=len(users_raw)))
-
-            # Format user profiles and convert to DF
-            users_json = FormatUsers(users_raw, team_mob)
-            UserDF_add = pd.DataFrame(users_json)
-            # Concat DF with previous user DF
-            UserDF = pd.concat([UserDF, UserDF_add], ignore_index = True)
-
-            page += 1
+    # Call the YinzCam API, fetching batches of pages of 10,000 concurrently
+    # until a page comes back short
+    more_pages = True
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        while more_pages:
+            t1 = time()
+            pages = range(page, page + PAGE_WORKERS)
+            users_pages = executor.map(lambda p: GetUsersPage(p, user, pssd), pages)
+
+            for page_number, users_raw in zip(pages, users_pages):
+                # Format user profiles and convert to DF
+                UserDF_add = FormatUsers(users_raw, team_mob)
+                UserDF_list.append(UserDF_add)
+
+                # If the resonse is less than 10,000, all records have been ingested
+                if len(UserDF_add) < 10000:
+                    logging.info("There are no more records. End Call.")
+                    more_pages = False
+                    break
+
+            page += PAGE_WORKERS
             t2 = time()
-            logging.info("It took {0:.2} min to get {1} records"\
-                .format(float(t2-t1)/60.0,len(users_json)))
+            logging.info("It took %.2g min to get pages %s to %s",
+                (t2-t1)/60.0, pages[0], page_number)
 
-            # If the resonse is less than 10,000, all records have been ingested
-            if len(users_json) < 10000:
-                logging.info("There are no more records. End Call.")
-                break
+    # Concat the user DF from every call once all pages are ingested
+    UserDF = pd.concat(UserDF_list, ignore_index = True)
 
     end_ingest = time() - start_ingest
-    logging.info("IngestUserProfiles took {0:.2} min to pull the data"\
-        .format(float(end_ingest)/60.0))
-    logging.info("Total users from this call = {0}".format(len(UserDF)))
+    logging.info("IngestUserProfiles took %.2g min to pull the data", end_ingest/60.0)
+    logging.info("Total users from this call = %s", len(UserDF))
 
     # Export DF to ADL
-    ExportCSVtoADL(team, UserDF)
+    ExportCSVtoADL(team, UserDF, compress=compress)
+
+
+# =============================================================================
+#   GetUsersPage(page, user, pssd)                                            =
+#                                                                             =
+#   Accepts a page number and the YinzCam API credentials. Calls the API for  =
+#   that page of 10,000 users using the shared session. Returns the raw JSON  =
+#   user profiles of the page. Safe to call from several threads at once.     =
+# =============================================================================
+
+def GetUsersPage(page, user, pssd):
+    logging.debug("Creating API call for page %s.", page)
+
+    # Format the API url
+    url = ('https://ydp-api.yinzcam.com/profiles/JANRAIN?page={page}&limit={limit}'\
+                .format(page=page, limit=10000))
+
+    # Try the API call
+    rsp_code = None
+    try:
+        logging.debug("Sending GET request to YinzCam API.")
+        response = http.get(url=url, auth=(user,pssd), timeout=(10, 240))
+        rsp_code = response.status_code
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logging.error("GET request to API failed. Response code: %s. Error: %s.", rsp_code, e)
+        raise
+
+    logging.debug("Response code: %s.", rsp_code)
+    users_raw = json_loads(response.content)['Users']
+    logging.debug("Page %s has %s records.", page, len(users_raw))
+    return users_raw
 
 
 # =============================================================================
 #   FormatUsers(users, team_mob)                                              =
 #                                                                             =
-#   Accepts raw user JSON from API. Loops through each profile entry,         =
-#   reformatting the data into key-value pairs, and retaining the specified   =
-#   fields for each user profile. Checks the data integrity -> if first user  =
-#   entry does not contain a yinzid, exit the program. Returns a list of      =
-#   cleaned user entries.                                                     =
+#   Accepts raw user JSON from API. Reads every profile entry into one long   =
+#   frame of key-value pairs, then pivots it to one row per user,             =
+#   retaining the specified fields for each user profile. Checks the data     =
+#   integrity -> if a user does not contain a yinzid, exit the program.       =
+#   Returns a DataFrame of cleaned user entries.                              =
 # =============================================================================
 
 def FormatUsers(users, team_mob):
     start_format = time()
     logging.info("Formatting JSON for users in this API call.")
 
-    user_list = []
-
-    # Loop through each user entry
-    for user_entry in users:
-        user = {'yinzid': None, 'email': None, 'first_name': None, 'last_name': None,
-        'id_global': None, 'firstLogin': None, 'lastLogin': None, 'clientId': None}
-
-        # Loop through each key-value pair entry
-        for entry in user_entry['Entry']:
-            # Reformat the entries to key-value pairs
-            formatted_entry = prettify_json(entry)
-            entry_key = list(formatted_entry.keys())[0]
-            entry_value = list(formatted_entry.values())[0]
-            # Process jainrain_clients info if user has it
-            if entry_key == 'janrain_clients' and entry_value != '[]':
-                janrain_client_info = json.loads(formatted_entry['janrain_clients'])
-                for record in janrain_client_info:
-                    # Only record the entry for the team being processed
-                    if record['clientId'] == team_mob:
-                        user['clientId'] = team_mob
-                        user['firstLogin'] = record['firstLogin']
-                        user['lastLogin'] = record['lastLogin']
-            # If entry key contained in user_json, update user_json value
-            elif entry_key in user.keys():
-                user.update(formatted_entry)
-
-        # Check the integrity of the data
-        if user['yinzid'] == None:
-            logging.info("This user appears to be missing yinzid: {user}"\
-                .format(user=user))
-            raise Exception("Something is wonky with this API call, retry.")
-
-        # Add each formatted user to the user list
-        user_list.append(user)
+    user_fields = ['yinzid', 'email', 'first_name', 'last_name',
+        'id_global', 'firstLogin', 'lastLogin', 'clientId']
+    login_fields = ['clientId', 'firstLogin', 'lastLogin']
+
+    if len(users) == 0:
+        return pd.DataFrame(columns=user_fields)
+
+    # Collect the key-value pair entries of every user into one long frame.
+    # Each entry is a single-level dict whose first two values are the key
+    # and the value, so they are read directly rather than flattened.
+    entries = pd.DataFrame(
+        [(user_number,) + tuple(entry.values())[:2]
+            for user_number, user_entry in enumerate(users)
+            for entry in user_entry['Entry']],
+        columns=['user', 'key', 'value'])
+
+    # Pivot the retained fields to one row per user, last entry wins
+    fields = entries[entries['key'].isin(user_fields)]\
+        .drop_duplicates(subset=['user', 'key'], keep='last')
+    # Columns with no entries come back as float64 NaN, keep them object so
+    # the login fields can be filled with strings below
+    user_df = fields.pivot(index='user', columns='key', values='value')\
+        .reindex(index=range(len(users)), columns=user_fields)\
+        .astype(object)\
+        .rename_axis(index=None, columns=None)
+
+    # Process jainrain_clients info for users that have it
+    janrain = entries[(entries['key'] == 'janrain_clients') & (entries['value'] != '[]')]
+    client_records = janrain.set_index('user')['value'].apply(json_loads).explode().dropna()
+    if len(client_records) > 0:
+        clients = pd.DataFrame(client_records.tolist(), index=client_records.index)\
+            .reindex(columns=login_fields)
+        # Only record the entry for the team being processed
+        clients = clients[clients['clientId'] == team_mob]
+        clients = clients[~clients.index.duplicated(keep='last')]
+        user_df.loc[clients.index, login_fields] = clients[login_fields]
+
+    # Check the integrity of the data
+    missing_yinzid = user_df['yinzid'].isnull()
+    if missing_yinzid.any():
+        logging.info("This user appears to be missing yinzid: %s",
+            user_df[missing_yinzid].iloc[0].to_dict())
+        raise Exception("Something is wonky with this API call, retry.")
 
     end_format = time() - start_format
-    logging.info("Formatting this batch took {0:.2} min."\
-        .format(float(end_format)/60.0))
+    logging.info("Formatting this batch took %.2g min.", end_format/60.0)
 
-    return user_list
+    return user_df
 
 
 # =============================================================================
-#   ExportCSVtoADL(team, UserDF)                                              =
+#   ExportCSVtoADL(team, UserDF, compress=False)                              =
 #                                                                             =
 #   Accepts the user DataFrame and the team value. Creates an ADL file        =
 #   system client. Defines the data lake path and file name. Exports DF to    =
-#   ADL.                                                                      =
+#   ADL, gzip compressed when `compress` is set.                              =
 # =============================================================================
 
-def ExportCSVtoADL(team, UserDF):
+def ExportCSVtoADL(team, UserDF, compress=False):
     start_export = time()
     logging.info("Starting Export to ADL.")
 
@@ -223,16 +265,23 @@ def ExportCSVtoADL(team, UserDF):
     # Define data lake file path
     data_lake_directory = '/yinz_cam/{team}_tor/users/'.format(team=team.lower())
     file_name = '{team}_yinzcam_users.csv'.format(team=team.lower())
+    if compress:
+        file_name += '.gz'
 
     # Write file to ADL
-    logging.info("Writing UserDF to: {directory}{file}."\
-        .format(directory=data_lake_directory, file=file_name))
+    logging.info("Writing UserDF to: %s%s.", data_lake_directory, file_name)
     with adlsFileSystemClient.open(data_lake_directory + file_name, 'wb') as f:
-        f.write(str.encode(UserDF.to_csv(index = False)))
+        # Stream the CSV into the ADL file instead of building it in memory
+        out = gzip.GzipFile(fileobj=f, mode='wb') if compress else f
+        writer = io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=True)
+        UserDF.to_csv(writer, index = False)
+        writer.flush()
+        writer.detach()
+        if compress:
+            out.close()
 
     end_export = time() - start_export
-    logging.info("Exporting the file to ADL took {0:.2} min."\
-        .format(float(end_export)/60.0))
+    logging.info("Exporting the file to ADL took %.2g min.", end_export/60.0)
 
 
 # =============================================================================
@@ -259,29 +308,6 @@ def get_adl_conf():
                         resource = 'https://datalake.azure.net/')
     return adlCreds, store_name
 
-# Restuctures User Profile JSON into correct key:value pairs
-def prettify_json(entry):
-    processed_entry_pair = {}
-    # Flatten the JSON (removes a level of nesting)
-    flat_entry = flatten_json(entry)
-    # Pull the value pairs into a new key-value pair & insert into dict
-    key = list(flat_entry.values())[0]
-    value = list(flat_entry.values())[1]
-    processed_entry_pair[key] = value
-    return processed_entry_pair
-
-# Flattens nested JSON structures
-def flatten_json(y):
-    out = {}
-    def flatten(x, name=''):
-        if type(x) is dict:
-            for a in x:
-                flatten(x[a], name + a + '_')
-        else:
-            out[name[:-1]] = x
-    flatten(y)
-    return out
-
 
 # =============================================================================
 #   Main                                                                      =
@@ -300,6 +326,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='This script will ingest data\
         from YinzCam API User Profiles')
     parser.add_argument('team', help="the team being ingested", type=str)
+    parser.add_argument('-c', '--compress', action='store_true',
+        help="writes a gzip compressed CSV file (.csv.gz) to ADL")
     # Set team value from args
     args = parser.parse_args()
     team = args.team.upper()
@@ -316,9 +344,8 @@ if __name__ == '__main__':
     logging.getLogger().setLevel(logging.INFO)
 
     # Start main module to ingest user profiles
-    IngestUserProfiles(team)
+    IngestUserProfiles(team, compress=args.compress)
 
     # End program run time
     program_end = time() - program_start
-    logging.info("Program Complete. Run time: {0:.2} min."\
-        .format(float(program_end )/60.0))
\ No newline at end of file
+    logging.info("Program Complete. Run time: %.2g min.", program_end/60.0)
\ No newline at end of file
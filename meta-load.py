@@ -1,73 +1,208 @@
-import requests, configparser, os, logging, sys
+import requests, configparser, os, logging, tempfile, hashlib
 
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from time import time
+from functools import lru_cache
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 
 from azure.datalake.store import core, lib, multithread
 
-def main(logger):
+# List of url endpoints to be ingested, with the file name each is stored under
+_URL_LIST = [(url, url.rsplit('/', 1)[1]) for url in [
+    'http://data-ftp.yinzcam.com/mlse/meta/meta-push.csv',
+    'http://data-ftp.yinzcam.com/mlse/meta/meta-media-mls.csv',
+    'http://data-ftp.yinzcam.com/mlse/meta/meta-media-nhl.csv',
+    'http://data-ftp.yinzcam.com/mlse/meta/meta-media-nba.csv',
+    'http://data-ftp.yinzcam.com/mlse/meta/meta-card-views.csv']]
+
+# Sub directory of the data lake directory holding the .etag and .md5 sidecar
+# files, so the data directory itself only contains the ingested CSVs
+_SIDECAR_DIRECTORY = '_meta/'
+
+def _probe_server(url, session):
+
+    # Get the file length and version tag from the server without downloading the file
+    response = None
+    head = session.head(url, allow_redirects=True)
+    head.raise_for_status()
+    headers = head.headers
+    if 'Content-Length' not in headers:
+        # Server did not send the length with HEAD, read it from the GET headers
+        response = session.get(url, stream=True)
+        if not response.ok:
+            response.close()
+            response.raise_for_status()
+        headers = response.headers
+    return headers, response
+
+
+def _probe_datalake(data_lake_directory, file_name, adlsFileSystemClient):
+
+    # Get current CSV file length from data lake, a missing file has length 0
+    try:
+        file_size_datalake = adlsFileSystemClient.info(data_lake_directory + file_name)['length']
+    except FileNotFoundError:
+        file_size_datalake = 0
+
+    # Get the server tag stored in a sidecar file in the meta directory
+    tag_path = data_lake_directory + _SIDECAR_DIRECTORY + file_name + '.etag'
+    try:
+        datalake_tag = adlsFileSystemClient.cat(tag_path).decode()
+    except FileNotFoundError:
+        datalake_tag = None
+    return file_size_datalake, datalake_tag
+
+
+def _process_url(url, file_name, adlsFileSystemClient, data_lake_directory, session, server_probe, datalake_probe,
+                 logger):
 
-    # Configure access to config file
-    config_file = ('./config')
-    config = configparser.ConfigParser()
-    if os.path.isfile(config_file):
-        config.read(config_file)
+    t1 = time()
+    tag_path = data_lake_directory + _SIDECAR_DIRECTORY + file_name + '.etag'
+    md5_path = data_lake_directory + _SIDECAR_DIRECTORY + file_name + '.md5'
+
+    headers, response = server_probe
+    file_size_datalake, datalake_tag = datalake_probe
+    file_size_server = int(headers['Content-Length'])
+    server_tag = headers.get('ETag') or headers.get('Last-Modified')
+
+    # Compare the server tag with the one stored in the data lake, fall back to
+    # comparing lengths if the server sends no tag
+    if server_tag is not None:
+        file_updated = server_tag != datalake_tag or file_size_datalake == 0
+    else:
+        file_updated = file_size_server > file_size_datalake
+
+    # Check if there have been updates to the file and only download updated files
+    if file_updated:
+        logger.info("Updating: %s", file_name)
+        if response is None:
+            response = session.get(url, stream=True)
+        # Stream the response body to a temporary file, hashing it on the way.
+        # MD5 is only used to detect content changes. hashlib releases the GIL
+        # while hashing these chunks, so the transfer threads hash in parallel
+        # and the CPU work does not need to move to a process pool.
+        content_md5 = hashlib.md5()
+        if not response.ok:
+            # Never write an error body over the data lake file or record its tag
+            response.close()
+            response.raise_for_status()
+        tmp = tempfile.NamedTemporaryFile(suffix='_' + file_name, delete=False)
+        try:
+            # Remove the temporary file on every exit, including a failed download
+            with response, tmp:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    if chunk:
+                        content_md5.update(chunk)
+                        tmp.write(chunk)
+            content_md5 = content_md5.hexdigest()
+            # The content MD5 sidecar is only needed once the file has been downloaded
+            try:
+                datalake_md5 = adlsFileSystemClient.cat(md5_path).decode()
+            except FileNotFoundError:
+                datalake_md5 = None
+            # Skip the upload if the content matches what is already in adl
+            if content_md5 == datalake_md5 and file_size_datalake > 0:
+                logger.info("%s has no content change, skipping the upload.", file_name)
+            else:
+                # Upload the file to adl in chunks on several threads
+                multithread.ADLUploader(adlsFileSystemClient, lpath=tmp.name,
+                                        rpath=data_lake_directory + file_name,
+                                        nthreads=8, overwrite=True, chunksize=4194304,
+                                        buffersize=4194304, blocksize=4194304)
+                with adlsFileSystemClient.open(md5_path, 'wb') as f:
+                    f.write(content_md5.encode())
+                logger.info("%s has been updated.", file_name)
+        finally:
+            os.remove(tmp.name)
+        # Only reached after a successful transfer, so the tag matches the stored file
+        if server_tag is not None:
+            with adlsFileSystemClient.open(tag_path, 'wb') as f:
+                f.write(server_tag.encode())
     else:
-        raise IOError('Please make sure you have the configuration file in correct path.')
+        if response is not None:
+            response.close()
+        logger.info("%s in the datalake is up to date with the file from the server", file_name)
+
+    t2 = time() - t1
+    logger.info("Total elapsed time to process %s = %.2f sec", file_name, t2)
+
+
+@dataclass(frozen=True)
+class Config:
+    username: str
+    password: str
+    tenant_id: str
+    client_secret: str
+    client_id: str
+    store_name: str
+
+    @classmethod
+    def from_file(cls, config_file):
+
+        # Configure access to config file
+        config = configparser.ConfigParser()
+        if os.path.isfile(config_file):
+            config.read(config_file)
+        else:
+            raise IOError('Please make sure you have the configuration file in correct path.')
+
+        return cls(username = config.get('YinzCamDaily', 'username'),
+                   password = config.get('YinzCamDaily', 'password'),
+                   # Set up credentials for data lake
+                   tenant_id = config.get('ADL', 'tenant_id'),
+                   client_secret = config.get('ADL', 'client_secret'),
+                   client_id = config.get('ADL', 'client_id'),
+                   store_name = config.get('ADL', 'store_name'))
 
-    username = config.get('YinzCamDaily', 'username')
-    password = config.get('YinzCamDaily', 'password')
 
-    # Set up credentials for data lake
-    tenant_id = config.get('ADL', 'tenant_id')
-    client_secret = config.get('ADL', 'client_secret')
-    client_id = config.get('ADL', 'client_id')
-    store_name = config.get('ADL', 'store_name')
+@lru_cache(maxsize=1)
+def _get_config(config_file='./config'):
 
-    adlCreds = lib.auth(tenant_id = tenant_id,
-                        client_secret = client_secret,
-                        client_id = client_id,
+    # Read the config file once per process
+    return Config.from_file(config_file)
+
+
+@lru_cache(maxsize=1)
+def _get_adl_client(config):
+
+    # Authenticate once per process, the credential refreshes its own token
+    # before it expires so the client can be reused across calls to main
+    adlCreds = lib.auth(tenant_id = config.tenant_id,
+                        client_secret = config.client_secret,
+                        client_id = config.client_id,
                         resource = 'https://datalake.azure.net/')
-    adlsFileSystemClient = core.AzureDLFileSystem(adlCreds, store_name = store_name)
+    return core.AzureDLFileSystem(adlCreds, store_name = config.store_name)
 
-    data_lake_directory = '/yinz_cam/cards_content/'
 
-    # List of url endpoints to be ingested
-    url_list = ['http://data-ftp.yinzcam.com/mlse/meta/meta-push.csv',
-        'http://data-ftp.yinzcam.com/mlse/meta/meta-media-mls.csv',
-        'http://data-ftp.yinzcam.com/mlse/meta/meta-media-nhl.csv',
-        'http://data-ftp.yinzcam.com/mlse/meta/meta-media-nba.csv',
-        'http://data-ftp.yinzcam.com/mlse/meta/meta-card-views.csv']
+def main(logger):
 
-    # Transfer files from yinz_cam http server to data lake
-    for url in url_list:
+    config = _get_config()
+    adlsFileSystemClient = _get_adl_client(config)
 
-        file_size_datalake = 0
+    data_lake_directory = '/yinz_cam/cards_content/'
 
-        t1 = time()
-        response = requests.get(url, auth=(username, password))
-        file_name = url.split('meta/')[1]
-
-        # Get current CSV file length from data lake
-        if adlsFileSystemClient.exists(data_lake_directory + file_name):
-            file_info = adlsFileSystemClient.info(data_lake_directory + file_name)
-            file_size_datalake = file_info['length']
-
-        file_size_server = int(response.headers['Content-length'])
-
-        # Check if there have been updates to the file and only download updated files
-        if file_size_server > file_size_datalake:
-            print("Updating: " + file_name)
-            # Collect text from response and write to adl
-            data = response.text
-            with adlsFileSystemClient.open(data_lake_directory + file_name, 'wb') as f:
-                f.write(str.encode(data))
-            print(file_name + " has been updated.")
-        else:
-            print("{file} in the datalake has the same size as file from the server".format(file=file_name))
+    # Reuse authenticated connections to the yinz_cam http server across all files
+    with requests.Session() as session:
+        session.auth = (config.username, config.password)
+        session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                             max_retries=Retry(total=3, backoff_factor=0.3)))
+
+        with ThreadPoolExecutor(max_workers=2 * len(_URL_LIST)) as executor:
+            # Probe the server and the data lake for every file at the same time
+            server_probes = [executor.submit(_probe_server, url, session) for url, file_name in _URL_LIST]
+            datalake_probes = [executor.submit(_probe_datalake, data_lake_directory, file_name, adlsFileSystemClient)
+                               for url, file_name in _URL_LIST]
 
-        t2 = time() - t1
-        logger.info("Total elapsed time to process {file} = {0:.2f} sec".format(float(t2), file=file_name))
+            # Transfer files from yinz_cam http server to data lake, one thread per file
+            transfers = [executor.submit(_process_url, url, file_name, adlsFileSystemClient, data_lake_directory,
+                                         session, server_probe.result(), datalake_probe.result(), logger)
+                         for (url, file_name), server_probe, datalake_probe
+                         in zip(_URL_LIST, server_probes, datalake_probes)]
+            for transfer in transfers:
+                transfer.result()
 
 
 if __name__ == "__main__":
@@ -79,4 +214,4 @@ if __name__ == "__main__":
 
 	main(logger)
 	elapsed = time() - elapsed
-	logger.info("Total elapsed time for the script = {0:.2f} sec".format(float(elapsed)))
\ No newline at end of file
+	logger.info("Total elapsed time for the script = %.2f sec", elapsed)
\ No newline at end of file